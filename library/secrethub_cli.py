@@ -1,10 +1,24 @@
 import errno
+import io
+import json
 import os
 import platform
+import re
 import shutil
+import socket
+import struct
 import subprocess
 import tempfile
+import time
 import zipfile
+from stat import S_IWGRP, S_IWOTH
+
+try:
+    # Python 3
+    from http.client import BadStatusLine, HTTPException, HTTPSConnection
+except ImportError:
+    # Python 2
+    from httplib import BadStatusLine, HTTPException, HTTPSConnection
 
 from ansible.module_utils.secrethub_base import BaseModule
 
@@ -78,6 +92,19 @@ install_dir:
                Add this directory to the PATH to make the CLI globally accessible.
 '''
 
+_SYSTEM = platform.system()
+_IS_WINDOWS = _SYSTEM == 'Windows'
+# The pointer size gives the same answer as platform.architecture(), without spawning `file`.
+_ARCH = 'amd64' if struct.calcsize('P') == 8 else 'x86'
+
+RELEASES_HOST = 'get.secrethub.io'
+LATEST_VERSION_CACHE = 'secrethub_latest_version'
+LATEST_VERSION_TTL = 5 * 60
+LATEST_VERSION_INSTALLED_TTL = 24 * 60 * 60
+VERSION_PATTERN = re.compile(r'^v?\d+(\.\d+)*$')
+VERSION_FILE = '.secrethub.version'
+COPY_BUFFER_SIZE = 256 * 1024
+
 
 class CLIModule(BaseModule):
 
@@ -100,6 +127,8 @@ class CLIModule(BaseModule):
             },
         }
         super(CLIModule, self).__init__(argument_spec)
+        self._connection = None
+        self._current_versions = {}
 
     def run(self):
         """ Installs or upgrades the SecretHub CLI when needed.
@@ -117,11 +146,14 @@ class CLIModule(BaseModule):
             'install_dir': self.install_dir(),
             'version': current_version,
         })
-        if self.params.get('state', 'present') == 'present':
+        state = self.params.get('state', 'present')
+        if state == 'present':
+            # The target version is only resolved here, so that removing the CLI
+            # never needs to reach the SecretHub server.
             target_version = self.target_version()
             if current_version != target_version:
                 self.install(version=target_version)
-        if self.params.get('state', 'present') == 'absent':
+        elif state == 'absent':
             if current_version is not None:
                 self.uninstall()
         self.exit()
@@ -135,21 +167,107 @@ class CLIModule(BaseModule):
         but the user that runs the module has no permission to execute it, the
         module fails.
 
+        The version is determined only once per path; install and uninstall update it.
+        When the binary was installed by this module, the version is read from the
+        version file that install writes next to it, so the binary does not have to
+        be executed.
+
         :return: The current version of the SecretHub CLI, or None
                       if the SecretHub CLI is not installed in the configured path.
         :rtype: str
         """
         path = self.bin_path()
+        if path not in self._current_versions:
+            self._current_versions[path] = self.installed_version(path)
+        return self._current_versions[path]
+
+    def installed_version(self, path):
+        """ Get the version of the SecretHub CLI binary at the given path.
+
+        :param str path: The path of the SecretHub CLI binary.
+        :return: The version of the SecretHub CLI, or None if the binary does not exist.
+        :rtype: str
+        """
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # The file does not exist, so there is no current version.
+                return None
+            raise
+
+        version = self.recorded_version(stat)
+        if version is None:
+            return self.probe_version(path)
+        if not os.access(path, os.X_OK):
+            self.fail('secrethub_cli: found {} but cannot execute: permission denied'.format(path))
+        return version
+
+    def recorded_version(self, stat):
+        """ Get the version recorded in the version file when the CLI was installed.
+
+        The recorded version is only used when the modification time and size of
+        the binary still match, so a binary that was replaced by other means is
+        not reported with a stale version.
+
+        :param os.stat_result stat: The result of os.stat on the binary.
+        :return: The recorded version, or None if no matching version is recorded.
+        :rtype: str
+        """
+        try:
+            with open(self.version_file(), 'r') as f:
+                recorded = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(recorded, dict):
+            return None
+        if recorded.get('mtime') != stat.st_mtime or recorded.get('size') != stat.st_size:
+            return None
+        return recorded.get('version')
+
+    def record_version(self, version):
+        """ Record the installed version in the version file.
+
+        Failing to write the version file is not fatal, as it only means the
+        version is probed by executing the binary on the next run.
+
+        :param str version: The version of the installed SecretHub CLI.
+        """
+        try:
+            stat = os.stat(self.bin_path())
+            with open(self.version_file(), 'w') as f:
+                json.dump({
+                    'version': version,
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                }, f)
+        except (IOError, OSError):
+            pass
+
+    def version_file(self):
+        """
+        :return: The absolute path to the file in which the installed version is recorded.
+        :rtype: str
+        """
+        return os.path.join(self.install_dir(), VERSION_FILE)
+
+    def probe_version(self, path):
+        """ Get the version of the SecretHub CLI by executing the binary at the given path.
+
+        :param str path: The path of the SecretHub CLI binary.
+        :return: The version of the SecretHub CLI, or None if the binary does not exist.
+        :rtype: str
+        """
         try:
             p = subprocess.Popen(
-                [self.bin_path(), '--version'],
+                [path, '--version'],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
             )
             version, err = p.communicate()
             # TODO SHDEV-1098: Why does the CLI return the version on stderr?
-            # Remove newline
-            return err[:-1].decode()
+            # Remove the trailing newline, which is CRLF on Windows.
+            return err.strip().decode('utf-8', 'replace')
         except OSError as e:
             if e.errno == errno.EACCES:
                 self.fail('secrethub_cli: found {} but cannot execute: {}'.format(path, e))
@@ -175,20 +293,166 @@ class CLIModule(BaseModule):
     def latest_version(self):
         """ Fetches the latest SecretHub CLI version from the SecretHub server.
 
+        The fetched version is cached in a file in the temporary directory, so that
+        consecutive runs within LATEST_VERSION_TTL seconds do not hit the server.
+        When a CLI is already installed, the cache is trusted for
+        LATEST_VERSION_INSTALLED_TTL seconds instead. The TTL can be overridden
+        with the SECRETHUB_LATEST_TTL environment variable. Setting it to 0
+        disables the cache. As the cache lives in a shared directory, it is only
+        used when read_latest_version_cache considers it trustworthy.
+
         :return: The latest SecretHub CLI version.
         :rtype: str
         """
+        cache_path = os.path.join(tempfile.gettempdir(), LATEST_VERSION_CACHE)
+        ttl = self.latest_version_ttl()
+        if ttl > 0:
+            version = self.read_latest_version_cache(cache_path, ttl)
+            if version is not None:
+                return version
+
+        try:
+            version = self.open_release('/releases/LATEST').read().decode().strip()
+        except (IOError, HTTPException) as e:
+            self.fail('secrethub_cli: failed to fetch latest version: {}'.format(e))
+
+        if ttl > 0 and VERSION_PATTERN.match(version):
+            self.write_latest_version_cache(cache_path, version)
+        return version
+
+    def latest_version_ttl(self):
+        """
+        :return: The number of seconds a cached latest version is considered fresh.
+        :rtype: int
+        """
+        ttl = os.environ.get('SECRETHUB_LATEST_TTL')
+        if not ttl:
+            if self.current_version() is not None:
+                return LATEST_VERSION_INSTALLED_TTL
+            return LATEST_VERSION_TTL
+        try:
+            return int(ttl)
+        except ValueError:
+            self.fail('secrethub_cli: SECRETHUB_LATEST_TTL must be an integer, got: {}'.format(ttl))
+
+    @staticmethod
+    def read_latest_version_cache(cache_path, ttl):
+        """ Reads the latest version from the cache file.
+
+        Other users can create files in the temporary directory, so the cache is
+        only used when it is owned by the current user, is not writable by others,
+        is younger than ttl without having a modification time in the future, and
+        contains a valid version.
+
+        :param str cache_path: The path of the cache file.
+        :param int ttl: The number of seconds a cached version is considered fresh.
+        :return: The cached version, or None if there is no usable cache.
+        :rtype: str
+        """
+        try:
+            fd = os.open(cache_path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            return None
+        try:
+            with os.fdopen(fd, 'r') as f:
+                cache_stat = os.fstat(f.fileno())
+                if hasattr(os, 'getuid') and cache_stat.st_uid != os.getuid():
+                    return None
+                if cache_stat.st_mode & (S_IWGRP | S_IWOTH):
+                    return None
+                now = time.time()
+                if not now - ttl < cache_stat.st_mtime <= now:
+                    return None
+                version = f.read().strip()
+        except (IOError, OSError, ValueError):
+            return None
+        if not VERSION_PATTERN.match(version):
+            return None
+        return version
+
+    @staticmethod
+    def write_latest_version_cache(cache_path, version):
+        """ Atomically writes the latest version to the cache file.
+
+        Failing to write the cache is not fatal, as it only means the next run
+        fetches the latest version again.
+
+        :param str cache_path: The path of the cache file.
+        :param str version: The latest version to cache.
+        """
+        tmp_file = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                    mode='w',
+                    dir=os.path.dirname(cache_path),
+                    prefix=LATEST_VERSION_CACHE,
+                    delete=False,
+            ) as f:
+                tmp_file = f.name
+                f.write(version)
+            # os.replace is not available on Python 2.
+            getattr(os, 'replace', os.rename)(tmp_file, cache_path)
+        except (IOError, OSError):
+            if tmp_file is not None and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def open_release(self, path):
+        """ Opens a file on the SecretHub releases server.
+
+        A single HTTPS connection to the releases server is kept open for the
+        lifetime of the module, so that fetching the latest version and fetching
+        the binary share one TCP connection and TLS handshake. Redirects are
+        followed with a regular urlopen. When an HTTPS proxy is configured for
+        the releases server, the file is fetched with urlopen as well, as only
+        urlopen honours the proxy environment variables.
+
+        :param str path: The path of the file on the releases server, e.g. /releases/LATEST
+        :raises IOError: when the file cannot be fetched.
+        :return: A file-like object from which the response body can be read.
+        """
         try:
             # Python 3
-            from urllib.request import urlopen
+            from urllib.parse import urljoin
+            from urllib.request import getproxies, proxy_bypass, urlopen
         except ImportError:
             # Python 2
+            from urllib import getproxies, proxy_bypass
+            from urlparse import urljoin
             from urllib2 import urlopen
 
+        url = 'https://{}{}'.format(RELEASES_HOST, path)
+        if getproxies().get('https') and not proxy_bypass(RELEASES_HOST):
+            return urlopen(url)
+
+        def get():
+            self._connection.request('GET', path)
+            return self._connection.getresponse()
+
+        if self._connection is None:
+            self._connection = HTTPSConnection(RELEASES_HOST)
         try:
-            return urlopen('https://get.secrethub.io/releases/LATEST').read().decode()
-        except IOError as e:
-            self.fail('secrethub_cli: failed to fetch latest version: {}'.format(e))
+            try:
+                response = get()
+            except (BadStatusLine, socket.error) as e:
+                if not isinstance(e, BadStatusLine) and e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                    raise
+                # The server may have closed the kept-alive connection after the
+                # previous request, so reconnect and retry once.
+                self._connection.close()
+                response = get()
+        except HTTPException as e:
+            # Closing resets the connection, so that a next request reconnects.
+            self._connection.close()
+            raise IOError('{}: {}'.format(path, e))
+
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.getheader('Location')
+            response.read()
+            return urlopen(urljoin(url, location))
+        if response.status != 200:
+            response.read()
+            raise IOError('{}: {} {}'.format(path, response.status, response.reason))
+        return response
 
     def bin_path(self):
         """
@@ -196,7 +460,7 @@ class CLIModule(BaseModule):
         :rtype: str
         """
         bin_name = 'secrethub'
-        if platform.system() == 'Windows':
+        if _IS_WINDOWS:
             bin_name = 'secrethub.exe'
         return os.path.join(self.install_dir(), bin_name)
 
@@ -214,51 +478,39 @@ class CLIModule(BaseModule):
         path = self.params.get('install_dir')
         if path:
             return path
-        if platform.system() == 'Windows':
+        if _IS_WINDOWS:
             # TODO: Test whether this works on a windows machine.
             return 'C://Program Files/SecretHub/'
         return '/usr/local/secrethub/'
 
     def fetch_binary(self, version):
-        """ Fetches the SecretHub CLI binary to a temporary file.
+        """ Fetches the SecretHub CLI release zip into memory.
 
-        The SecretHub CLI binary for this system and architecture is fetched
-        from the SecretHub server and placed in a temporary file.
+        The SecretHub CLI release zip for this system and architecture is fetched
+        from the SecretHub server. Release zips are small, so the zip is kept in
+        memory instead of being written to a temporary file first.
 
         :param version: The SecretHub CLI version to fetch.
-        :return: The path to the temporary file of the fetched zip
-                              and a function to cleanup the temporary files.
-        :rtype: (str, lambda)
+        :return: A file-like object containing the fetched zip.
+        :rtype: io.BytesIO
         """
-        fetch_url = 'https://get.secrethub.io/releases/{}/secrethub-{}-{}-{}.zip'.format(
+        fetch_path = '/releases/{}/secrethub-{}-{}-{}.zip'.format(
             version,
             version,
-            str(platform.system()).lower(),
-            'amd64' if str(platform.architecture()[0]).lower() == '64bit' else 'x86'
+            _SYSTEM.lower(),
+            _ARCH,
         )
-        tmp_dir = tempfile.mkdtemp()
-
-        def cleanup():
-            shutil.rmtree(tmp_dir)
-
-        tmp_file = os.path.join(tmp_dir, 'secrethub-cli.zip')
-
-        try:
-            # Python 3
-            from urllib.request import urlretrieve
-        except ImportError:
-            # Python 2
-            from urllib import urlretrieve
 
         try:
-            urlretrieve(fetch_url, tmp_file)
+            return io.BytesIO(self.open_release(fetch_path).read())
+        except HTTPException as e:
+            # E.g. IncompleteRead when the download is cut off.
+            self.fail('secrethub_cli: failed to fetch {}: {}'.format(fetch_path, e))
         except (IOError, OSError) as e:
-            cleanup()
             if e.errno == errno.EACCES:
                 # TODO: Do we want to have a more descriptive error message?
                 self.fail(msg='secrethub_cli: {}'.format(e))
             raise
-        return tmp_file, cleanup
 
     def install(self, version):
         """ Installs the given version of the SecretHub CLI.
@@ -267,21 +519,29 @@ class CLIModule(BaseModule):
 
         :param version: The version of the SecretHub CLI to install.
         """
-        tmp_file, cleanup = self.fetch_binary(version)
+        bin_path = self.bin_path()
         try:
-            with zipfile.ZipFile(tmp_file, 'r') as cli_zip:
-                cli_zip.extractall(path=self.install_dir())
+            with zipfile.ZipFile(self.fetch_binary(version), 'r') as cli_zip:
+                bin_name = os.path.basename(bin_path)
+                members = [name for name in cli_zip.namelist() if os.path.basename(name) == bin_name]
+                if not members:
+                    self.fail('secrethub_cli: {} not found in the release of version {}'.format(bin_name, version))
+                if not os.path.isdir(self.install_dir()):
+                    os.makedirs(self.install_dir())
+                # Only the binary is extracted, the other files in the release are not needed.
+                with cli_zip.open(members[0]) as src, open(bin_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
         except (IOError, OSError) as e:
-            cleanup()
             if e.errno == errno.EACCES:
                 # TODO: Do we want to have a more descriptive error message?
                 self.fail('secrethub_cli: {}'.format(e))
             raise
-        cleanup()
         os.chmod(self.bin_path(), 0o711)
+        self.record_version(version)
+        self._current_versions[self.bin_path()] = version
         self.returns.update({
             'changed': True,
-            'version': self.current_version(),
+            'version': version,
         })
 
     def uninstall(self):
@@ -289,9 +549,12 @@ class CLIModule(BaseModule):
         """
         try:
             os.remove(self.bin_path())
+            if os.path.exists(self.version_file()):
+                os.remove(self.version_file())
+            self._current_versions[self.bin_path()] = None
             self.returns.update({
                 'changed': True,
-                'version': self.current_version(),
+                'version': None,
             })
         except OSError as e:
             if e.errno == errno.EACCES:
@@ -3,6 +3,8 @@ import os
 import platform
 import subprocess
 
+_IS_WINDOWS = platform.system() == 'Windows'
+
 
 class Client:
 
@@ -19,15 +21,22 @@ class Client:
         :param str credential: When supplied, this credential will be used to decrypt your accounts encryption key.
         :param str credential_passphrase: The passphrase used to decrypt the credential.
         """
-        self._cli_path = '/usr/local/secrethub/secrethub'
-        if platform.system() == 'Windows':
-            self._cli_path = 'C://Program Files/SecretHub/secrethub.exe'
         if cli_path is not None:
             self._cli_path = cli_path
+        elif _IS_WINDOWS:
+            self._cli_path = 'C://Program Files/SecretHub/secrethub.exe'
+        else:
+            self._cli_path = '/usr/local/secrethub/secrethub'
         self.config_dir = config_dir
         self.credential = credential
         self.credential_passphrase = credential_passphrase
 
+        self._env = os.environ.copy()
+        if credential:
+            self._env['SECRETHUB_CREDENTIAL'] = credential
+        if credential_passphrase:
+            self._env['SECRETHUB_CREDENTIAL_PASSPHRASE'] = credential_passphrase
+
     def read(self, path):
         """Read a secret on the given path.
 
@@ -107,30 +116,15 @@ class Client:
             command.append('--config-dir={}'.format(self.config_dir))
         command += args
 
-        env = os.environ.copy()
-        if self.credential:
-            env['SECRETHUB_CREDENTIAL'] = self.credential
-        if self.credential_passphrase:
-            env['SECRETHUB_CREDENTIAL_PASSPHRASE'] = self.credential_passphrase
-
         try:
-            if stdin:
-                p = subprocess.Popen(
-                    command,
-                    env=env,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                )
-            else:
-                p = subprocess.Popen(
-                    command,
-                    env=env,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                )
+            p = subprocess.Popen(
+                command,
+                env=self._env,
+                stdin=subprocess.PIPE if stdin is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
         except OSError as e:
             if e.errno == errno.ENOENT:
                 raise CLINotFound(self._cli_path)
@@ -6,6 +6,14 @@ from ansible.module_utils.client import Client
 
 class BaseModule(AnsibleModule):
 
+    # The client options and the environment variables they can be set with.
+    _ENV_MAP = {
+        'cli_path': 'SECRETHUB_CLI_PATH',
+        'config_dir': 'SECRETHUB_CONFIG_DIR',
+        'credential': 'SECRETHUB_CREDENTIAL',
+        'credential_passphrase': 'SECRETHUB_CREDENTIAL_PASSPHRASE',
+    }
+
     def __init__(self, argument_spec):
         """ Initialize a new SecretHub module.
 
@@ -17,6 +25,7 @@ class BaseModule(AnsibleModule):
         self.returns = {
             'changed': False,
         }
+        self._client = None
 
         argument_spec.update(
             {
@@ -59,24 +68,28 @@ class BaseModule(AnsibleModule):
         self.exit_json(**self.returns)
 
     def client(self):
-        """ Create a new client with the configured options.
+        """ Get the client with the configured options.
+
+        The client is created on the first call and reused afterwards.
 
-        :return: The created client.
+        :return: The client.
         :rtype: module_utils.client.Client
         """
-        options = {}
-        for name in ['cli_path', 'config_dir', 'credential', 'credential_passphrase']:
-            option = self.get_option(name)
-            if option:
-                options[name] = option
-        return Client(**options)
+        if self._client is None:
+            options = {}
+            for name in self._ENV_MAP:
+                option = self.get_option(name)
+                if option:
+                    options[name] = option
+            self._client = Client(**options)
+        return self._client
 
     def get_option(self, name):
         """ Get the value of an option.
 
         The first of the following is returned:
         1. The value of the parameter in the playbook.
-        2. The value of an environment variable SECRETHUB_<capitalized option name>.
+        2. The value of the environment variable for the option in _ENV_MAP, e.g. SECRETHUB_CLI_PATH.
         3. None
 
         :param name: The name of the option to retrieve.
@@ -85,5 +98,5 @@ class BaseModule(AnsibleModule):
         """
         option = self.params.get(name)
         if not option:
-            option = os.environ.get('SECRETHUB_'.format(name.upper()), None)
+            option = os.environ.get(self._ENV_MAP[name], None)
         return option